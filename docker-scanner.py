@@ -5,16 +5,188 @@ Searches multiple Bitbucket projects and repositories for Dockerfiles,
 extracts all base images from FROM statements, and outputs a deduplicated list.
 """
 
-import requests
+import asyncio
+import contextlib
+import datetime
+import email.utils
+import functools
+import getpass
+import importlib.util
+import json
+import logging
+import os
+import queue
 import re
 import sys
-from typing import Set, List, Dict
-from requests.auth import HTTPBasicAuth
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from logging.handlers import QueueHandler, QueueListener
+from typing import (Set, List, Dict, Tuple, Optional, TextIO, FrozenSet, Callable, Generator,
+                    Mapping, NamedTuple, TypeVar, Union)
+from urllib.parse import urlencode
 import argparse
 
+# requests is only needed by the threaded scanner; the async scanner and the
+# parsing and caching logic work without it
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+except ImportError:
+    requests = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# httpx only negotiates HTTP/2 when the h2 package is installed
+_HTTP2_AVAILABLE = importlib.util.find_spec('h2') is not None
+
+
+log = logging.getLogger(__name__)
+
+# Matches paths whose file name is 'Dockerfile' or 'Dockerfile.*' (either case)
+_DOCKERFILE_RE = re.compile(r'(?:^|/)[Dd]ockerfile(?:\.[^/]+)?$')
+
+# Matches FROM statements across a whole Dockerfile body (bytes), one per line:
+# FROM image:tag, FROM --platform=... image:tag, FROM image AS alias
+# Group 1 is the image, group 2 the optional build stage alias. Words may be
+# separated by a backslash line continuation. Being anchored to the start of
+# a line, it never matches inside a comment.
+_FROM_SEP = rb'(?:[ \t]|\\\r?\n)+'
+_FROM_RE = re.compile(
+    rb'^[ \t]*FROM' + _FROM_SEP + rb'(?:--platform=[^\s\\]+' + _FROM_SEP + rb')?([^\s\\]+)'
+    rb'(?:' + _FROM_SEP + rb'AS' + _FROM_SEP + rb'([^\s\\]+))?',
+    re.IGNORECASE | re.MULTILINE,
+)
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'bitbucket-docker-scanner')
+
+# Stored in each cache file; bump it whenever the entry layout or Dockerfile
+# parsing changes so entries written by older versions are discarded
+_CACHE_VERSION = 3
+
+# Seconds between cache saves while scanning, so an interrupted scan keeps
+# most of its work
+_SAVE_INTERVAL = 60
+
+_DEFAULT_HEADERS = {
+    'Accept': 'application/json',
+    'User-Agent': 'BitbucketDockerScanner/1.0',
+}
+
+# Retry policy for GETs that hit transient server errors or rate limiting
+_RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+_MAX_RETRIES = 5
+_BACKOFF_FACTOR = 0.3
+_BACKOFF_MAX = 120
+
+
+class ScanError(Exception):
+    """
+    A request to Bitbucket failed or returned an error status.
+    
+    Both HTTP backends raise this, so scanning logic handles a single error type.
+    """
+    
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class _Request(NamedTuple):
+    method: str
+    url: str
+    params: Optional[Dict] = None
+    headers: Optional[Dict] = None
+    json: Optional[Dict] = None
+
+
+class _Response(NamedTuple):
+    url: str
+    status_code: int
+    headers: Mapping[str, str]
+    content: bytes
+    
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise ScanError(f"{self.status_code} error for url: {self.url}", self.status_code)
+
+
+T = TypeVar('T')
+
+# Scanning logic is written as generators that yield each _Request and are
+# sent its _Response, or have a ScanError thrown in. The same steps then run
+# on the threaded requests backend and on the asyncio httpx backend.
+Steps = Generator[_Request, _Response, T]
+
+
+def _json_body(response: _Response):
+    """
+    Decode a JSON response body, using orjson when it is installed.
+    
+    A body that is not JSON, such as a proxy's HTML error page, raises
+    ScanError so it is handled like any other failed request.
+    """
+    try:
+        if orjson is not None:
+            return orjson.loads(response.content)
+        return json.loads(response.content)
+    except ValueError as e:
+        # Both decoders' errors subclass ValueError
+        raise ScanError(f"Invalid JSON from {response.url}: {e}") from e
+
+
+def _cached(ttl: int, key: Callable[..., Optional[str]]):
+    """
+    Cache the result of a scanner's steps in the on-disk listings cache.
+    
+    Results are only stored when the call logged no listing errors, so a
+    partial listing is never reused.
+    
+    Args:
+        ttl: Seconds a cached result stays valid
+        key: Builds the cache key from the method's arguments, or returns
+            None to bypass the cache for that call
+    """
+    def lookup(self, args, kwargs):
+        cache_key = key(self, *args, **kwargs)
+        if cache_key is None or not self.listings_path:
+            return None, None
+        entry = self._listings.get(cache_key)
+        if entry and time.time() - entry['time'] < ttl:
+            return cache_key, entry
+        return cache_key, None
+    
+    def store(self, cache_key, errors, value):
+        if cache_key is not None and self._listing_errors == errors:
+            with self._lock:
+                self._listings[cache_key] = {'time': time.time(), 'value': value}
+    
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            cache_key, entry = lookup(self, args, kwargs)
+            if entry:
+                return entry['value']
+            errors = self._listing_errors
+            value = yield from func(self, *args, **kwargs)
+            store(self, cache_key, errors, value)
+            return value
+        return wrapper
+    return decorator
+
 
 class BitbucketDockerScanner:
-    def __init__(self, base_url: str, username: str, password: str):
+    def __init__(self, base_url: str, username: str, password: str, max_workers: int = 16,
+                 cache_dir: Optional[str] = DEFAULT_CACHE_DIR, head_bytes: int = 0):
         """
         Initialize the Bitbucket scanner.
         
@@ -22,12 +194,253 @@ class BitbucketDockerScanner:
             base_url: Bitbucket server URL (e.g., 'https://bitbucket.example.com')
             username: Bitbucket username
             password: Bitbucket password or API token
+            max_workers: Number of repositories to scan concurrently
+            cache_dir: Directory for the response cache, or None to disable it
+            head_bytes: Download only this many leading bytes of each
+                Dockerfile when they contain a FROM statement, or 0 to
+                always download whole files
         """
         self.base_url = base_url.rstrip('/')
-        self.auth = HTTPBasicAuth(username, password)
-        self.session = requests.Session()
-        self.session.auth = self.auth
+        self.username = username
+        self.auth = (username, password)
+        self.max_workers = max_workers
+        self.head_bytes = head_bytes
+        self.session = self._create_session()
+        
         self.base_images: Set[str] = set()
+        self._lock = threading.Lock()
+        
+        # File that newly found images are appended to while scanning
+        self._output: Optional[TextIO] = None
+        
+        # Cleared when the server has no code search endpoint
+        self._code_search_available = True
+        
+        # Repositories that hit an error this run; their results are not cached
+        self._failed: Set[Tuple[str, str]] = set()
+        
+        self.cache_path = os.path.join(cache_dir, 'responses.json') if cache_dir else None
+        self._cache: Dict[str, Dict] = self._load_json(self.cache_path)
+        
+        # Project and repository listings, see _cached
+        self.listings_path = os.path.join(cache_dir, 'listings.json') if cache_dir else None
+        self._listings: Dict[str, Dict] = self._load_json(self.listings_path)
+        self._listing_errors = 0
+        self._last_save = time.monotonic()
+    
+    def _create_session(self) -> Optional['requests.Session']:
+        """
+        Create the HTTP session shared by all worker threads.
+        
+        Returns:
+            Configured requests session
+        """
+        if requests is None:
+            raise RuntimeError("BitbucketDockerScanner requires requests")
+        
+        session = requests.Session()
+        session.auth = self.auth
+        session.headers.update(_DEFAULT_HEADERS)
+        
+        # Size the connection pool above the worker count so concurrent
+        # requests reuse connections instead of discarding them, and retry
+        # transient server errors and rate limiting with backoff
+        retries = Retry(
+            total=_MAX_RETRIES,
+            backoff_factor=_BACKOFF_FACTOR,
+            status_forcelist=sorted(_RETRY_STATUSES),
+            allowed_methods=['GET'],
+        )
+        adapter = HTTPAdapter(pool_connections=32, pool_maxsize=64, max_retries=retries)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+    
+    def _send(self, request: _Request) -> _Response:
+        """
+        Send a request with the shared session.
+        
+        Args:
+            request: Request to send
+            
+        Returns:
+            The response, whatever its status
+        """
+        try:
+            response = self.session.request(request.method, request.url, params=request.params,
+                                            headers=request.headers, json=request.json)
+        except requests.exceptions.RequestException as e:
+            raise ScanError(str(e)) from e
+        return _Response(response.url, response.status_code, response.headers, response.content)
+    
+    def _run(self, steps: Steps[T]) -> T:
+        """
+        Run scanning steps to completion, sending each request they yield.
+        
+        Args:
+            steps: Generator from one of the scanning methods
+            
+        Returns:
+            The value the steps return
+        """
+        try:
+            request = next(steps)
+            while True:
+                try:
+                    response = self._send(request)
+                except ScanError as e:
+                    request = steps.throw(e)
+                else:
+                    request = steps.send(response)
+        except StopIteration as stop:
+            return stop.value
+    
+    @staticmethod
+    def _load_json(path: Optional[str]) -> Dict[str, Dict]:
+        """
+        Load a cache file from disk.
+        
+        Args:
+            path: Cache file path, or None if caching is disabled
+            
+        Returns:
+            Cache entries, empty if none could be read
+        """
+        if not path:
+            return {}
+        
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            log.warning("Ignoring unreadable cache %s: %s", path, e)
+            return {}
+        
+        if not isinstance(data, dict) or data.get('version') != _CACHE_VERSION:
+            log.info("Discarding cache %s written by another version", path)
+            return {}
+        return data['entries']
+    
+    def _write_json(self, path: str, data: Dict[str, Dict]):
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with self._lock, open(tmp_path, 'w') as f:
+                json.dump({'version': _CACHE_VERSION, 'entries': data}, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            log.error("Error writing cache %s: %s", path, e)
+    
+    def save_cache(self):
+        """
+        Write the response and listings caches to disk.
+        """
+        if self.cache_path:
+            self._write_json(self.cache_path, self._cache)
+        if self.listings_path:
+            self._write_json(self.listings_path, self._listings)
+        self._last_save = time.monotonic()
+    
+    def _save_periodically(self):
+        if time.monotonic() - self._last_save >= _SAVE_INTERVAL:
+            self.save_cache()
+    
+    def _cache_key(self, url: str, params: Optional[Dict] = None) -> str:
+        # Responses depend on what the account can see, so each user gets
+        # their own entries
+        url = f"{url}?{urlencode(sorted(params.items()))}" if params else url
+        return f"{self.username} {url}"
+    
+    def _head_key(self, url: str) -> str:
+        # Images parsed from partial downloads depend on how much was read,
+        # so they are cached separately for each --head-bytes setting
+        return self._cache_key(url, {'head_bytes': self.head_bytes} if self.head_bytes else None)
+    
+    def _revalidation_headers(self, key: str, headers: Optional[Dict]) -> Tuple[Dict, Optional[Dict]]:
+        """
+        Add validators from any cached entry to request headers.
+        
+        Args:
+            key: Cache key of the entry
+            headers: Optional extra request headers
+            
+        Returns:
+            The request headers and the cached entry, if any
+        """
+        entry = self._cache.get(key)
+        headers = dict(headers or {})
+        if entry:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers, entry
+    
+    def _conditional_get(self, url: str, params: Optional[Dict] = None, headers: Optional[Dict] = None,
+                         key: Optional[str] = None) -> Steps[Tuple[Optional[_Response], Optional[Dict]]]:
+        """
+        Issue a GET that revalidates any cached entry for the URL.
+        
+        Args:
+            url: Request URL
+            params: Optional query parameters
+            headers: Optional extra request headers
+            key: Cache key of the entry, if not the URL and parameters
+            
+        Returns:
+            (response, None) for a fresh response, or (None, entry) when the
+            server answered 304 Not Modified for the cached entry
+        """
+        key = key or self._cache_key(url, params)
+        headers, entry = self._revalidation_headers(key, headers)
+        response = yield _Request('GET', url, params=params, headers=headers)
+        if response.status_code == 304 and entry:
+            return None, entry
+        response.raise_for_status()
+        return response, None
+    
+    def _store(self, key: str, response: _Response, **values):
+        """
+        Cache values derived from a response if it carries validators.
+        
+        Args:
+            key: Cache key the request was revalidated with
+            response: Response the values were derived from
+            **values: JSON-serializable values to store alongside the validators
+        """
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if not etag and not last_modified:
+            return
+        
+        with self._lock:
+            self._cache[key] = {
+                'etag': etag,
+                'last_modified': last_modified,
+                **values,
+            }
+    
+    def _emit(self, images: FrozenSet[str]):
+        """
+        Record images and append any not seen before to the output file.
+        
+        Only called from the thread running scan(), so no locking is needed.
+        
+        Args:
+            images: Base images found in a repository
+        """
+        new_images = images - self.base_images
+        self.base_images |= new_images
+        if self._output and new_images:
+            self._output.writelines(f"{img}\n" for img in sorted(new_images))
+            self._output.flush()
+    
+    def _record_error(self, project_key: str, repo_slug: str, message: str, *args):
+        log.error(message, *args)
+        with self._lock:
+            self._failed.add((project_key, repo_slug))
     
     def get_projects(self, project_keys: List[str] = None) -> List[Dict]:
         """
@@ -39,28 +452,35 @@ class BitbucketDockerScanner:
         Returns:
             List of project dictionaries
         """
+        return self._run(self._projects(project_keys))
+    
+    @_cached(ttl=3600, key=lambda self, project_keys=None:
+             None if project_keys else f"{self.username} {self.base_url} projects")
+    def _projects(self, project_keys: List[str] = None) -> Steps[List[Dict]]:
         if project_keys:
             return [{'key': key} for key in project_keys]
         
         # If no specific projects, get all accessible projects
         projects = []
         url = f"{self.base_url}/rest/api/1.0/projects"
+        start = 0
         
-        while url:
+        while True:
             try:
-                response = self.session.get(url)
+                response = yield _Request('GET', url, params={'limit': 100, 'start': start})
                 response.raise_for_status()
-                data = response.json()
+                data = _json_body(response)
                 
                 projects.extend(data.get('values', []))
                 
                 # Check for pagination
                 if data.get('isLastPage', True):
                     break
-                url = f"{self.base_url}{data.get('nextPageStart', '')}"
+                start = data['nextPageStart']
                 
-            except requests.exceptions.RequestException as e:
-                print(f"Error fetching projects: {e}", file=sys.stderr)
+            except ScanError as e:
+                log.error("Error fetching projects: %s", e)
+                self._listing_errors += 1
                 break
         
         return projects
@@ -75,24 +495,30 @@ class BitbucketDockerScanner:
         Returns:
             List of repository dictionaries
         """
+        return self._run(self._repositories(project_key))
+    
+    @_cached(ttl=3600, key=lambda self, project_key: f"{self.username} {self.base_url} repos:{project_key}")
+    def _repositories(self, project_key: str) -> Steps[List[Dict]]:
         repositories = []
         url = f"{self.base_url}/rest/api/1.0/projects/{project_key}/repos"
+        start = 0
         
-        while url:
+        while True:
             try:
-                response = self.session.get(url, params={'limit': 100})
+                response = yield _Request('GET', url, params={'limit': 100, 'start': start})
                 response.raise_for_status()
-                data = response.json()
+                data = _json_body(response)
                 
                 repositories.extend(data.get('values', []))
                 
                 # Check for pagination
                 if data.get('isLastPage', True):
                     break
-                url = f"{self.base_url}/rest/api/1.0/projects/{project_key}/repos"
+                start = data['nextPageStart']
                 
-            except requests.exceptions.RequestException as e:
-                print(f"Error fetching repositories for project {project_key}: {e}", file=sys.stderr)
+            except ScanError as e:
+                log.error("Error fetching repositories for project %s: %s", project_key, e)
+                self._listing_errors += 1
                 break
         
         return repositories
@@ -101,6 +527,10 @@ class BitbucketDockerScanner:
         """
         Search for Dockerfiles in a repository.
         
+        Uses the code search API when the server provides it, and falls back
+        to listing every file in the repository otherwise or when a search
+        fails.
+        
         Args:
             project_key: Bitbucket project key
             repo_slug: Repository slug
@@ -108,131 +538,611 @@ class BitbucketDockerScanner:
         Returns:
             List of Dockerfile paths
         """
-        dockerfiles = []
+        return self._run(self._dockerfiles(project_key, repo_slug))
+    
+    def _dockerfiles(self, project_key: str, repo_slug: str) -> Steps[List[str]]:
+        if self._code_search_available:
+            dockerfiles = yield from self._search_code(project_key, repo_slug)
+            if dockerfiles is not None:
+                return dockerfiles
         
-        # Search for files named 'Dockerfile' or matching 'Dockerfile.*'
-        search_patterns = ['Dockerfile', 'dockerfile']
+        return (yield from self._list_dockerfiles(project_key, repo_slug))
+    
+    def _search_code(self, project_key: str, repo_slug: str) -> Steps[Optional[List[str]]]:
+        """
+        Find Dockerfiles in a repository with the code search API.
         
-        for pattern in search_patterns:
-            url = f"{self.base_url}/rest/api/1.0/projects/{project_key}/repos/{repo_slug}/files"
+        Args:
+            project_key: Bitbucket project key
+            repo_slug: Repository slug
             
+        Returns:
+            List of Dockerfile paths, or None if the repository's files must
+            be listed instead because code search is unavailable or failed
+        """
+        dockerfiles = []
+        url = f"{self.base_url}/rest/search/latest/search"
+        start = 0
+        
+        while True:
+            body = self._search_body(project_key, repo_slug, start)
             try:
-                response = self.session.get(url, params={'limit': 1000})
+                response = yield _Request('POST', url, json=body)
+                if response.status_code == 404:
+                    # Concurrent workers may all get here; only the first logs
+                    with self._lock:
+                        available, self._code_search_available = self._code_search_available, False
+                    if available:
+                        log.info("Code search is not available, listing repository files instead")
+                    return None
                 response.raise_for_status()
-                data = response.json()
+                code = _json_body(response).get('code', {})
+                dockerfiles.extend(self._search_hits(code))
                 
-                # Filter files that are Dockerfiles
-                for file_path in data.get('values', []):
-                    file_name = file_path.split('/')[-1]
-                    if (file_name == 'Dockerfile' or 
-                        file_name.startswith('Dockerfile.') or
-                        file_name == 'dockerfile' or
-                        file_name.startswith('dockerfile.')):
-                        dockerfiles.append(file_path)
+                # Check for pagination
+                if code.get('isLastPage', True):
+                    break
+                start = code['nextStart']
                 
-            except requests.exceptions.RequestException as e:
-                print(f"Error searching files in {project_key}/{repo_slug}: {e}", file=sys.stderr)
+            except ScanError as e:
+                # Discard any partial hits; the file listing is complete
+                log.warning("Error searching code in %s/%s, listing files instead: %s", project_key, repo_slug, e)
+                return None
         
-        return list(set(dockerfiles))  # Remove duplicates
+        return list(dict.fromkeys(dockerfiles))  # Remove duplicates, keep order
     
-    def get_file_content(self, project_key: str, repo_slug: str, file_path: str) -> str:
+    @staticmethod
+    def _search_body(project_key: str, repo_slug: str, start: int) -> Dict:
+        return {
+            'query': f"project:{project_key} repo:{repo_slug} filename:Dockerfile",
+            'entities': {'code': {'start': start, 'limit': 100}},
+        }
+    
+    @staticmethod
+    def _search_hits(code: Dict) -> List[str]:
         """
-        Get the content of a file from Bitbucket.
+        Get the Dockerfile paths from a page of code search results.
+        
+        Args:
+            code: The 'code' section of a search response
+            
+        Returns:
+            List of Dockerfile paths
+        """
+        dockerfiles = []
+        
+        # Search matches on file name tokens, so hits are filtered again
+        for hit in code.get('values', []):
+            file_path = hit.get('file')
+            if isinstance(file_path, dict):
+                file_path = '/'.join(file_path.get('components', []))
+            if file_path and _DOCKERFILE_RE.search(file_path):
+                dockerfiles.append(file_path)
+        
+        return dockerfiles
+    
+    @staticmethod
+    def _file_page(data: Dict) -> Dict:
+        """
+        Reduce a page of the file listing to its Dockerfiles and pagination.
+        
+        Args:
+            data: Decoded /files response
+            
+        Returns:
+            Page dictionary with 'values', 'isLastPage' and 'nextPageStart'
+        """
+        return {
+            'values': [p for p in data.get('values', []) if _DOCKERFILE_RE.search(p)],
+            'isLastPage': data.get('isLastPage', True),
+            'nextPageStart': data.get('nextPageStart'),
+        }
+    
+    def _list_dockerfiles(self, project_key: str, repo_slug: str) -> Steps[List[str]]:
+        """
+        Find Dockerfiles in a repository by listing all of its files.
         
         Args:
             project_key: Bitbucket project key
             repo_slug: Repository slug
-            file_path: Path to the file
             
         Returns:
-            File content as string
+            List of Dockerfile paths
+        """
+        dockerfiles = []
+        url = f"{self.base_url}/rest/api/1.0/projects/{project_key}/repos/{repo_slug}/files"
+        start = 0
+        
+        while True:
+            params = {'limit': 1000, 'start': start}
+            try:
+                response, page = yield from self._conditional_get(url, params=params)
+                
+                if response is not None:
+                    page = self._file_page(_json_body(response))
+                    self._store(self._cache_key(url, params), response, **page)
+                
+                dockerfiles.extend(page['values'])
+                
+                # Check for pagination
+                if page['isLastPage']:
+                    break
+                start = page['nextPageStart']
+                
+            except ScanError as e:
+                self._record_error(project_key, repo_slug,
+                                   "Error searching files in %s/%s: %s", project_key, repo_slug, e)
+                break
+        
+        return list(dict.fromkeys(dockerfiles))  # Remove duplicates, keep order
+    
+    def _process_dockerfile(self, project_key: str, repo_slug: str, file_path: str) -> Steps[Set[str]]:
+        """
+        Download a Dockerfile and extract its base images, reusing the cached
+        result when the file has not changed.
+        
+        Args:
+            project_key: Bitbucket project key
+            repo_slug: Repository slug
+            file_path: Path to the Dockerfile
+            
+        Returns:
+            Set of base image names
         """
         url = f"{self.base_url}/rest/api/1.0/projects/{project_key}/repos/{repo_slug}/raw/{file_path}"
+        key = self._head_key(url)
         
         try:
-            response = self.session.get(url)
-            response.raise_for_status()
-            return response.text
-        except requests.exceptions.RequestException as e:
-            print(f"Error fetching file {file_path} from {project_key}/{repo_slug}: {e}", file=sys.stderr)
-            return ""
+            response, entry = yield from self._conditional_get(url, headers=self._raw_headers(), key=key)
+            content = response.content if response is not None else None
+            
+            if response is not None and response.status_code == 206:
+                content = self._usable_head(content)
+                if content is None:
+                    # The leading bytes are not enough; fetch the whole file
+                    response, entry = yield from self._conditional_get(url, headers={'Accept': '*/*'}, key=key)
+                    content = response.content if response is not None else None
+        except ScanError as e:
+            if e.status_code == 416:
+                # Ranges are unsatisfiable for empty files
+                return set()
+            self._record_error(project_key, repo_slug,
+                               "Error fetching file %s from %s/%s: %s", file_path, project_key, repo_slug, e)
+            return set()
+        
+        if entry is not None:
+            return set(entry['images'])
+        return self._content_images(key, response, content)
+    
+    def _raw_headers(self) -> Dict:
+        # Raw file content is not JSON
+        headers = {'Accept': '*/*'}
+        if self.head_bytes:
+            headers['Range'] = f"bytes=0-{self.head_bytes - 1}"
+        return headers
+    
+    def _content_images(self, key: str, response: _Response, content: bytes) -> Set[str]:
+        """
+        Extract base images from downloaded Dockerfile content and cache them.
+        
+        Args:
+            key: Cache key of the raw file
+            response: Response the content came from
+            content: Dockerfile content, possibly only its leading lines
+            
+        Returns:
+            Set of base image names
+        """
+        images = self.extract_base_images(content)
+        self._store(key, response, images=sorted(images))
+        return images
+    
+    def _usable_head(self, content: bytes) -> Optional[bytes]:
+        """
+        Trim a partial Dockerfile download to whole lines.
+        
+        Args:
+            content: Leading bytes of the Dockerfile from a ranged request
+            
+        Returns:
+            The complete lines of the content, or None if they contain no
+            FROM statement and the whole file is needed
+        """
+        if len(content) < self.head_bytes:
+            # The range covered the whole file
+            return content
+        
+        # The range may end mid-line; keep only complete lines
+        end = content.rfind(b'\n')
+        if end == -1 or not _FROM_RE.search(content, 0, end):
+            return None
+        return content[:end + 1]
     
-    def extract_base_images(self, dockerfile_content: str) -> Set[str]:
+    @staticmethod
+    def extract_base_images(dockerfile_content: bytes) -> Set[str]:
         """
         Extract base images from Dockerfile content.
         
+        The content is scanned as bytes; only the captured image and alias
+        names are decoded.
+        
         Args:
-            dockerfile_content: Content of the Dockerfile
+            dockerfile_content: Raw content of the Dockerfile
             
         Returns:
             Set of base image names
         """
         images = set()
         
-        # Regex pattern to match FROM statements
-        # Matches: FROM image:tag, FROM --platform=... image:tag, FROM image AS alias
-        pattern = r'^\s*FROM\s+(?:--platform=[^\s]+\s+)?([^\s]+)(?:\s+AS\s+[^\s]+)?'
-        
-        for line in dockerfile_content.split('\n'):
-            # Skip comments
-            if line.strip().startswith('#'):
-                continue
-            
-            match = re.match(pattern, line, re.IGNORECASE)
-            if match:
-                image = match.group(1)
-                # Skip build stage references (they don't have : or are lowercase aliases)
-                if not image.startswith('$') and ':' in image or '/' in image or '@' in image:
-                    images.add(image)
-                elif not any(c.isupper() for c in image) and ':' not in image:
-                    # Likely a reference to a build stage, skip it
-                    continue
-                else:
-                    images.add(image)
+        # Build stage names are case-insensitive; 'scratch' is Docker's
+        # reserved empty image and never pulled
+        aliases = {'scratch'}
+        
+        for match in _FROM_RE.finditer(dockerfile_content):
+            image = match.group(1).decode('utf-8', 'replace')
+            
+            # Skip references to earlier build stages and unresolved build args.
+            # A stage's own alias is only declared after its FROM is resolved.
+            if image.lower() not in aliases and not image.startswith('$'):
+                images.add(image)
+            
+            if match.group(2):
+                aliases.add(match.group(2).decode('utf-8', 'replace').lower())
         
         return images
     
-    def scan(self, project_keys: List[str] = None) -> Set[str]:
+    def get_latest_commit(self, project_key: str, repo_slug: str) -> Optional[str]:
+        """
+        Get the ID of the latest commit on the repository's default branch.
+        
+        Args:
+            project_key: Bitbucket project key
+            repo_slug: Repository slug
+            
+        Returns:
+            Commit ID, or None if it could not be determined
+        """
+        return self._run(self._latest_commit(project_key, repo_slug))
+    
+    def _latest_commit(self, project_key: str, repo_slug: str) -> Steps[Optional[str]]:
+        url = f"{self.base_url}/rest/api/1.0/projects/{project_key}/repos/{repo_slug}/commits"
+        
+        try:
+            response = yield _Request('GET', url, params={'limit': 1})
+            response.raise_for_status()
+            values = _json_body(response).get('values', [])
+            return values[0]['id'] if values else None
+        except ScanError as e:
+            log.error("Error fetching latest commit for %s/%s: %s", project_key, repo_slug, e)
+            return None
+    
+    def _repo_key(self, project_key: str, repo_slug: str) -> str:
+        return self._head_key(f"{self.base_url}/rest/api/1.0/projects/{project_key}/repos/{repo_slug}/commits")
+    
+    def _unchanged_repo_images(self, project_key: str, repo_slug: str,
+                               commit: Optional[str]) -> Optional[FrozenSet[str]]:
+        """
+        Get a repository's cached images if it has not changed since they were stored.
+        
+        Args:
+            project_key: Bitbucket project key
+            repo_slug: Repository slug
+            commit: Latest commit ID, or None if unknown
+            
+        Returns:
+            Cached images, or None if the repository needs scanning
+        """
+        entry = self._cache.get(self._repo_key(project_key, repo_slug))
+        if commit and entry and entry.get('commit') == commit:
+            log.debug("Unchanged since last scan: %s/%s", project_key, repo_slug)
+            return frozenset(entry['images'])
+        return None
+    
+    def _store_repo_images(self, project_key: str, repo_slug: str, commit: Optional[str], images: Set[str]):
+        """
+        Cache a repository's images against its latest commit, unless its scan hit an error.
+        """
+        if commit and (project_key, repo_slug) not in self._failed:
+            with self._lock:
+                self._cache[self._repo_key(project_key, repo_slug)] = {
+                    'commit': commit,
+                    'images': sorted(images),
+                }
+    
+    def _scan_repo(self, project_key: str, repo_slug: str) -> Steps[FrozenSet[str]]:
+        """
+        Scan a single repository for Dockerfiles and extract base images.
+        
+        Results are cached by the repository's latest commit, so an unchanged
+        repository is not scanned again. This also covers servers that do not
+        send ETag or Last-Modified headers.
+        
+        Args:
+            project_key: Bitbucket project key
+            repo_slug: Repository slug
+            
+        Returns:
+            Set of base images found in the repository
+        """
+        commit = yield from self._latest_commit(project_key, repo_slug)
+        cached = self._unchanged_repo_images(project_key, repo_slug, commit)
+        if cached is not None:
+            return cached
+        
+        images: Set[str] = set()
+        log.debug("Scanning repository: %s/%s", project_key, repo_slug)
+        
+        dockerfiles = yield from self._dockerfiles(project_key, repo_slug)
+        
+        if dockerfiles:
+            log.debug("Found %s Dockerfile(s) in %s/%s", len(dockerfiles), project_key, repo_slug)
+            
+            for dockerfile_path in dockerfiles:
+                found = yield from self._process_dockerfile(project_key, repo_slug, dockerfile_path)
+                images.update(found)
+                if found:
+                    log.debug("Extracted %s image(s) from %s/%s/%s",
+                              len(found), project_key, repo_slug, dockerfile_path)
+        
+        self._store_repo_images(project_key, repo_slug, commit, images)
+        return frozenset(images)
+    
+    def _merge(self, project_key: str, repo_slug: str, result: Union[FrozenSet[str], BaseException]):
+        """
+        Emit a scanned repository's images, or record the error that stopped
+        its scan without aborting the others.
+        """
+        if isinstance(result, BaseException):
+            self._record_error(project_key, repo_slug, "Error scanning %s/%s: %r", project_key, repo_slug, result)
+        else:
+            self._emit(result)
+    
+    def scan(self, project_keys: List[str] = None, output: Optional[TextIO] = None) -> Set[str]:
         """
         Scan Bitbucket projects for Dockerfiles and extract base images.
         
+        Repositories are scanned concurrently using a thread pool that shares
+        the scanner's session. Each worker returns its own result, which is
+        merged here as it completes.
+        
         Args:
             project_keys: Optional list of specific project keys to scan
+            output: Optional file that each newly found image is appended to
+                as soon as its repository has been scanned
             
         Returns:
             Set of unique base images
         """
-        projects = self.get_projects(project_keys)
+        self._output = output
+        try:
+            projects = self.get_projects(project_keys)
+            
+            log.info("Scanning %s project(s)...", len(projects))
+            
+            repos: List[Tuple[str, str]] = []
+            for project in projects:
+                project_key = project['key']
+                log.info("Scanning project: %s", project_key)
+                
+                repositories = self.get_repositories(project_key)
+                log.info("Found %s repository(ies) in %s", len(repositories), project_key)
+                
+                repos.extend((project_key, repo['slug']) for repo in repositories)
+            
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = {executor.submit(self._run, self._scan_repo(pk, rs)): (pk, rs) for pk, rs in repos}
+                
+                try:
+                    for done, future in enumerate(as_completed(futures), 1):
+                        self._merge(*futures[future], future.exception() or future.result())
+                        log.info("Scanned %s/%s repositories", done, len(futures))
+                        self._save_periodically()
+                except BaseException:
+                    # Leaving the with block would otherwise wait for every
+                    # queued repository, so Ctrl-C would not stop the scan
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    raise
+        finally:
+            # Keep whatever was scanned, even if the run is interrupted
+            self.save_cache()
+        
+        return self.base_images
+
+
+class AsyncBitbucketDockerScanner(BitbucketDockerScanner):
+    """
+    Scanner that issues requests from a single asyncio event loop through an
+    httpx client, multiplexed over HTTP/2 when the server and the h2 package
+    support it. The scanning steps, caching and parsing are shared with
+    BitbucketDockerScanner; only the transport and scheduling differ.
+    
+    Requires httpx. Use scan_async() from code that already runs an event loop.
+    """
+    
+    def __init__(self, base_url: str, username: str, password: str, max_workers: int = 32,
+                 cache_dir: Optional[str] = DEFAULT_CACHE_DIR, head_bytes: int = 0):
+        """
+        Initialize the Bitbucket scanner.
+        
+        Args:
+            base_url: Bitbucket server URL (e.g., 'https://bitbucket.example.com')
+            username: Bitbucket username
+            password: Bitbucket password or API token
+            max_workers: Number of requests in flight at once
+            cache_dir: Directory for the response cache, or None to disable it
+            head_bytes: Download only this many leading bytes of each
+                Dockerfile when they contain a FROM statement, or 0 to
+                always download whole files
+        """
+        if httpx is None:
+            raise RuntimeError("AsyncBitbucketDockerScanner requires httpx")
+        
+        super().__init__(base_url, username, password, max_workers, cache_dir, head_bytes)
+        self.client: Optional['httpx.AsyncClient'] = None
+    
+    def _create_session(self) -> Optional['requests.Session']:
+        # Requests go through the httpx client opened by _open_client()
+        return None
+    
+    @contextlib.asynccontextmanager
+    async def _open_client(self):
+        transport = httpx.AsyncHTTPTransport(
+            http2=_HTTP2_AVAILABLE,
+            limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+            retries=3,
+        )
+        async with httpx.AsyncClient(
+            auth=self.auth,
+            headers=_DEFAULT_HEADERS,
+            transport=transport,
+            timeout=30,
+        ) as self.client:
+            try:
+                yield self.client
+            finally:
+                self.client = None
+    
+    @staticmethod
+    def _retry_delay(response: 'httpx.Response', retries: int) -> float:
+        """
+        Get the delay before retrying a response, as urllib3's Retry does.
+        
+        Args:
+            response: Response with a retryable status
+            retries: Number of attempts made so far
+            
+        Returns:
+            Seconds to wait before the next attempt
+        """
+        retry_after = response.headers.get('Retry-After', '').strip()
+        if retry_after and response.status_code in (413, 429, 503):
+            if retry_after.isdigit():
+                return float(retry_after)
+            try:
+                retry_at = email.utils.parsedate_to_datetime(retry_after)
+                return max(0.0, (retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+            except (TypeError, ValueError):
+                pass
         
-        print(f"Scanning {len(projects)} project(s)...")
+        if retries <= 1:
+            return 0.0
+        return min(_BACKOFF_FACTOR * 2 ** (retries - 1), _BACKOFF_MAX)
+    
+    async def _send_async(self, request: _Request) -> _Response:
+        """
+        Send a request with the httpx client, retrying GETs that hit transient
+        server errors or rate limiting.
         
-        for project in projects:
-            project_key = project['key']
-            print(f"\nScanning project: {project_key}")
+        Args:
+            request: Request to send
             
-            repositories = self.get_repositories(project_key)
-            print(f"  Found {len(repositories)} repository(ies)")
+        Returns:
+            The final response, whatever its status
+        """
+        for attempt in range(1, _MAX_RETRIES + 2):
+            try:
+                response = await self.client.request(request.method, request.url, params=request.params,
+                                                     headers=request.headers, json=request.json)
+            except httpx.HTTPError as e:
+                raise ScanError(str(e)) from e
             
-            for repo in repositories:
-                repo_slug = repo['slug']
-                print(f"    Scanning repository: {repo_slug}")
+            if (request.method != 'GET' or response.status_code not in _RETRY_STATUSES
+                    or attempt > _MAX_RETRIES):
+                break
+            await asyncio.sleep(self._retry_delay(response, attempt))
+        
+        return _Response(str(response.url), response.status_code, response.headers, response.content)
+    
+    async def _run_async(self, steps: Steps[T]) -> T:
+        """
+        Run scanning steps to completion on the open client.
+        
+        Args:
+            steps: Generator from one of the scanning methods
+            
+        Returns:
+            The value the steps return
+        """
+        try:
+            request = next(steps)
+            while True:
+                try:
+                    response = await self._send_async(request)
+                except ScanError as e:
+                    request = steps.throw(e)
+                else:
+                    request = steps.send(response)
+        except StopIteration as stop:
+            return stop.value
+    
+    def _run(self, steps: Steps[T]) -> T:
+        # Keeps the methods inherited from BitbucketDockerScanner synchronous
+        async def run():
+            async with self._open_client():
+                return await self._run_async(steps)
+        return asyncio.run(run())
+    
+    async def scan_async(self, project_keys: List[str] = None, output: Optional[TextIO] = None) -> Set[str]:
+        """
+        Scan Bitbucket projects for Dockerfiles and extract base images.
+        
+        Repository listings are fetched concurrently, then every repository
+        is scanned as its own task. Each task issues one request at a time,
+        and at most max_workers tasks run at once. Results are merged as
+        tasks complete.
+        
+        Args:
+            project_keys: Optional list of specific project keys to scan
+            output: Optional file that each newly found image is appended to
+                as soon as its repository has been scanned
+            
+        Returns:
+            Set of unique base images
+        """
+        self._output = output
+        semaphore = asyncio.Semaphore(self.max_workers)
+        
+        async def limited(steps: Steps[T]) -> T:
+            async with semaphore:
+                return await self._run_async(steps)
+        
+        async def scan_repo(project_key: str, repo_slug: str):
+            # Return errors instead of raising, like gather(return_exceptions=True)
+            try:
+                return project_key, repo_slug, await limited(self._scan_repo(project_key, repo_slug))
+            except Exception as e:
+                return project_key, repo_slug, e
+        
+        try:
+            async with self._open_client():
+                projects = await self._run_async(self._projects(project_keys))
+                
+                log.info("Scanning %s project(s)...", len(projects))
+                
+                keys = [project['key'] for project in projects]
+                listings = await asyncio.gather(*(limited(self._repositories(key)) for key in keys))
                 
-                dockerfiles = self.search_dockerfiles(project_key, repo_slug)
+                repos: List[Tuple[str, str]] = []
+                for project_key, repositories in zip(keys, listings):
+                    log.info("Found %s repository(ies) in %s", len(repositories), project_key)
+                    repos.extend((project_key, repo['slug']) for repo in repositories)
                 
-                if dockerfiles:
-                    print(f"      Found {len(dockerfiles)} Dockerfile(s)")
-                    
-                    for dockerfile_path in dockerfiles:
-                        print(f"        Processing: {dockerfile_path}")
-                        content = self.get_file_content(project_key, repo_slug, dockerfile_path)
-                        
-                        if content:
-                            images = self.extract_base_images(content)
-                            self.base_images.update(images)
-                            if images:
-                                print(f"          Extracted {len(images)} image(s)")
+                tasks = [scan_repo(pk, rs) for pk, rs in repos]
+                for done, task in enumerate(asyncio.as_completed(tasks), 1):
+                    self._merge(*await task)
+                    log.info("Scanned %s/%s repositories", done, len(tasks))
+                    self._save_periodically()
+        finally:
+            # Keep whatever was scanned, even if the run is interrupted
+            self.save_cache()
         
         return self.base_images
+    
+    def scan(self, project_keys: List[str] = None, output: Optional[TextIO] = None) -> Set[str]:
+        """
+        Run scan_async() to completion in a new event loop.
+        """
+        return asyncio.run(self.scan_async(project_keys, output))
 
 
 def main():
@@ -249,10 +1159,16 @@ def main():
         required=True,
         help='Bitbucket username'
     )
-    parser.add_argument(
+    password_group = parser.add_mutually_exclusive_group()
+    password_group.add_argument(
         '--password',
-        required=True,
-        help='Bitbucket password or API token'
+        help='Bitbucket password or API token. Prefer --password-stdin or BITBUCKET_TOKEN, '
+             'which keep it out of shell history and process listings'
+    )
+    password_group.add_argument(
+        '--password-stdin',
+        action='store_true',
+        help='Read the password or API token from stdin'
     )
     parser.add_argument(
         '--projects',
@@ -262,16 +1178,107 @@ def main():
     parser.add_argument(
         '--output',
         '-o',
-        help='Output file path (default: prints to stdout)'
+        help='Output file path (default: prints to stdout). Images are appended as they are found'
+    )
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='Keep images already in the output file instead of truncating it'
+    )
+    parser.add_argument(
+        '--verbose',
+        '-v',
+        action='store_true',
+        help='Log each repository and Dockerfile as it is scanned'
+    )
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Do not read or write the cache in ~/.cache/bitbucket-docker-scanner'
+    )
+    parser.add_argument(
+        '--head-bytes',
+        type=int,
+        default=0,
+        help='Download only the first N bytes of each Dockerfile when they contain a FROM statement; '
+             'later stages beyond them are missed. 0 downloads whole files (default: 0)'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=16,
+        help='Number of repositories to scan concurrently (default: 16)'
+    )
+    parser.add_argument(
+        '--async',
+        dest='use_async',
+        action='store_true',
+        help='Scan from a single asyncio event loop with httpx (HTTP/2 if h2 is installed) '
+             'instead of a thread pool'
     )
     
     args = parser.parse_args()
+    if args.workers < 1:
+        parser.error('--workers must be at least 1')
+    if args.head_bytes < 0:
+        parser.error('--head-bytes must not be negative')
+    if args.use_async and httpx is None:
+        parser.error('--async requires httpx')
+    if not args.use_async and requests is None:
+        parser.error('requests is not installed; install it or scan with --async')
+    
+    # Worker threads hand log records to a queue; a single listener thread
+    # writes them to stderr so workers never block on console output
+    log_queue: queue.Queue = queue.Queue()
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format='%(asctime)s %(levelname)s %(message)s',
+        handlers=[QueueHandler(log_queue)],
+    )
+    if not args.verbose:
+        # httpx logs every request at INFO; keep that detail behind -v
+        for name in ('httpx', 'httpcore'):
+            logging.getLogger(name).setLevel(logging.WARNING)
+    listener = QueueListener(log_queue, logging.StreamHandler())
+    listener.start()
+    try:
+        run(args)
+    finally:
+        listener.stop()
+
+
+def run(args: argparse.Namespace):
+    """
+    Scan Bitbucket and write the results for parsed command line arguments.
+    """
+    # Resolve the password, prompting only if nothing else provides one
+    if args.password_stdin:
+        # Strip CRLF too, for tokens piped from files saved on Windows
+        password = sys.stdin.readline().rstrip('\r\n')
+        if not password:
+            sys.exit('error: --password-stdin was given but stdin held no password')
+    elif os.environ.get('BITBUCKET_TOKEN'):
+        password = os.environ['BITBUCKET_TOKEN']
+    elif args.password:
+        password = args.password
+    else:
+        password = getpass.getpass(f"Bitbucket password for {args.username}: ")
     
     # Initialize scanner
-    scanner = BitbucketDockerScanner(args.url, args.username, args.password)
+    scanner_class = AsyncBitbucketDockerScanner if args.use_async else BitbucketDockerScanner
+    scanner = scanner_class(args.url, args.username, password, args.workers,
+                            cache_dir=None if args.no_cache else DEFAULT_CACHE_DIR,
+                            head_bytes=args.head_bytes)
     
-    # Scan repositories
-    base_images = scanner.scan(args.projects)
+    # Scan repositories, streaming results to the output file as they are found
+    if args.output:
+        if args.resume and os.path.exists(args.output):
+            with open(args.output) as f:
+                scanner.base_images.update(line.strip() for line in f if line.strip())
+        with open(args.output, 'a' if args.resume else 'w') as f:
+            base_images = scanner.scan(args.projects, output=f)
+    else:
+        base_images = scanner.scan(args.projects)
     
     # Sort images for consistent output
     sorted_images = sorted(base_images)
@@ -285,6 +1292,7 @@ def main():
     output_text = "\n".join(output_lines)
     
     if args.output:
+        # Rewrite the streamed file sorted and deduplicated
         with open(args.output, 'w') as f:
             f.write(output_text + "\n")
         print(f"\nResults written to: {args.output}")
@@ -0,0 +1,242 @@
+import email.utils
+import importlib.util
+import json
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta, timezone
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'docker-scanner.py')
+
+
+def load_scanner():
+    spec = importlib.util.spec_from_file_location('docker_scanner', SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+ds = load_scanner()
+
+BASE_URL = 'https://bitbucket.example.com'
+REPO_URL = f"{BASE_URL}/rest/api/1.0/projects/P/repos/r"
+
+
+class OfflineScanner(ds.BitbucketDockerScanner):
+    # The tests answer the scanning steps themselves, so no session is needed
+    def _create_session(self):
+        return None
+
+
+def response(status=200, body=b'', headers=None):
+    if not isinstance(body, bytes):
+        body = json.dumps(body).encode()
+    return ds._Response('', status, headers or {}, body)
+
+
+def drive(steps, responses):
+    """
+    Run scanning steps, answering each request with the next canned response.
+
+    ScanError instances are thrown into the steps instead of sent.
+
+    Returns:
+        The value the steps return and the requests they made
+    """
+    responses = list(responses)
+    requests = []
+    try:
+        request = next(steps)
+        while True:
+            requests.append(request)
+            answer = responses.pop(0)
+            if isinstance(answer, ds.ScanError):
+                request = steps.throw(answer)
+            else:
+                request = steps.send(answer)
+    except StopIteration as stop:
+        return stop.value, requests
+
+
+class ScannerTestCase(unittest.TestCase):
+    def setUp(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        self.cache_dir = cache_dir.name
+
+    def scanner(self, **kwargs):
+        return OfflineScanner(BASE_URL, 'user', 'secret', cache_dir=self.cache_dir, **kwargs)
+
+
+class ExtractBaseImagesTest(unittest.TestCase):
+    def setUp(self):
+        self.extract = ds.BitbucketDockerScanner.extract_base_images
+
+    def test_skips_references_to_earlier_stages(self):
+        content = b"FROM python:3.12 AS Builder\nFROM builder\nFROM alpine\n"
+        self.assertEqual(self.extract(content), {'python:3.12', 'alpine'})
+
+    def test_keeps_image_named_like_its_own_alias(self):
+        self.assertEqual(self.extract(b"FROM python AS python\n"), {'python'})
+        self.assertEqual(self.extract(b"FROM node AS node\nFROM node\n"), {'node'})
+
+    def test_stage_alias_only_applies_to_later_lines(self):
+        content = b"FROM build\nFROM golang:1.22 AS build\n"
+        self.assertEqual(self.extract(content), {'build', 'golang:1.22'})
+
+    def test_skips_comments_scratch_and_build_args(self):
+        content = b"# FROM ignored:1\nFROM $BASE\nFROM scratch\nFROM --platform=$BUILDPLATFORM node:20\n"
+        self.assertEqual(self.extract(content), {'node:20'})
+
+    def test_line_continuation(self):
+        content = b"FROM ubuntu:22.04 \\\n    AS build\nFROM build\n"
+        self.assertEqual(self.extract(content), {'ubuntu:22.04'})
+
+
+class PaginationTest(ScannerTestCase):
+    def test_follows_next_page_start(self):
+        scanner = self.scanner()
+        projects, requests = drive(scanner._projects(), [
+            response(body={'values': [{'key': 'A'}], 'isLastPage': False, 'nextPageStart': 25}),
+            response(body={'values': [{'key': 'B'}], 'isLastPage': True}),
+        ])
+        self.assertEqual([p['key'] for p in projects], ['A', 'B'])
+        self.assertEqual([r.params['start'] for r in requests], [0, 25])
+
+    def test_stops_and_counts_error(self):
+        scanner = self.scanner()
+        with self.assertLogs(ds.log, 'ERROR'):
+            repositories, _ = drive(scanner._repositories('P'), [
+                response(body={'values': [{'slug': 'r'}], 'isLastPage': False, 'nextPageStart': 1}),
+                response(500),
+            ])
+        self.assertEqual(repositories, [{'slug': 'r'}])
+        self.assertEqual(scanner._listing_errors, 1)
+
+
+class ListingCacheTest(ScannerTestCase):
+    def test_reuses_listing_until_ttl_expires(self):
+        scanner = self.scanner()
+        page = response(body={'values': [{'slug': 'r'}], 'isLastPage': True})
+        drive(scanner._repositories('P'), [page])
+
+        _, requests = drive(scanner._repositories('P'), [])
+        self.assertEqual(requests, [])
+
+        for entry in scanner._listings.values():
+            entry['time'] -= 3601
+        _, requests = drive(scanner._repositories('P'), [page])
+        self.assertEqual(len(requests), 1)
+
+    def test_partial_listing_is_not_cached(self):
+        scanner = self.scanner()
+        with self.assertLogs(ds.log, 'ERROR'):
+            drive(scanner._repositories('P'), [response(503)])
+        self.assertEqual(scanner._listings, {})
+
+    def test_listings_are_per_user(self):
+        scanner = self.scanner()
+        drive(scanner._projects(), [response(body={'values': [{'key': 'A'}], 'isLastPage': True})])
+        scanner.save_cache()
+
+        other = OfflineScanner(BASE_URL, 'other', 'secret', cache_dir=self.cache_dir)
+        _, requests = drive(other._projects(), [response(body={'values': [], 'isLastPage': True})])
+        self.assertEqual(len(requests), 1)
+
+
+class ConditionalRequestTest(ScannerTestCase):
+    def test_revalidates_file_listing(self):
+        scanner = self.scanner()
+        listing = {'values': ['README.md', 'app/Dockerfile'], 'isLastPage': True}
+        paths, _ = drive(scanner._list_dockerfiles('P', 'r'), [response(body=listing, headers={'ETag': '"v1"'})])
+        self.assertEqual(paths, ['app/Dockerfile'])
+
+        # A saved cache is reloaded by the next run
+        scanner.save_cache()
+        scanner = self.scanner()
+        paths, requests = drive(scanner._list_dockerfiles('P', 'r'), [response(304)])
+        self.assertEqual(paths, ['app/Dockerfile'])
+        self.assertEqual(requests[0].headers['If-None-Match'], '"v1"')
+
+    def test_unchanged_commit_skips_repository(self):
+        scanner = self.scanner()
+        scanner._code_search_available = False
+        commit = response(body={'values': [{'id': 'abc'}]})
+        images, _ = drive(scanner._scan_repo('P', 'r'), [
+            commit,
+            response(body={'values': ['Dockerfile'], 'isLastPage': True}),
+            response(body=b"FROM python:3.12\n"),
+        ])
+        self.assertEqual(images, {'python:3.12'})
+
+        images, requests = drive(scanner._scan_repo('P', 'r'), [commit])
+        self.assertEqual(images, {'python:3.12'})
+        self.assertEqual([r.url for r in requests], [f"{REPO_URL}/commits"])
+
+    def test_failed_repository_is_not_cached(self):
+        scanner = self.scanner()
+        scanner._code_search_available = False
+        with self.assertLogs(ds.log, 'ERROR'):
+            drive(scanner._scan_repo('P', 'r'), [
+                response(body={'values': [{'id': 'abc'}]}),
+                response(body={'values': ['Dockerfile'], 'isLastPage': True}),
+                ds.ScanError('connection reset'),
+            ])
+        self.assertNotIn(scanner._repo_key('P', 'r'), scanner._cache)
+
+    def test_cache_from_another_version_is_discarded(self):
+        with open(os.path.join(self.cache_dir, 'responses.json'), 'w') as f:
+            json.dump({f"{REPO_URL}/commits": {'commit': 'abc', 'images': ['stale']}}, f)
+        self.assertEqual(self.scanner()._cache, {})
+
+
+class HeadBytesTest(ScannerTestCase):
+    def test_usable_head(self):
+        scanner = self.scanner(head_bytes=16)
+        self.assertEqual(scanner._usable_head(b"FROM a\n"), b"FROM a\n")
+        self.assertEqual(scanner._usable_head(b"FROM alpine\nRUN x"), b"FROM alpine\n")
+        self.assertIsNone(scanner._usable_head(b"RUN apk add curl"))
+
+    def test_falls_back_to_whole_file(self):
+        scanner = self.scanner(head_bytes=16)
+        body = b"RUN echo padding\nFROM late:1\n"
+        images, requests = drive(scanner._process_dockerfile('P', 'r', 'Dockerfile'), [
+            response(206, body[:16]),
+            response(body=body),
+        ])
+        self.assertEqual(images, {'late:1'})
+        self.assertEqual(requests[0].headers['Range'], 'bytes=0-15')
+        self.assertNotIn('Range', requests[1].headers)
+
+    def test_partial_results_are_kept_apart(self):
+        headers = {'ETag': '"d1"'}
+        partial = self.scanner(head_bytes=16)
+        drive(partial._process_dockerfile('P', 'r', 'Dockerfile'), [response(206, b"FROM alpine\nRUN ", headers)])
+        partial.save_cache()
+
+        full = self.scanner()
+        _, requests = drive(full._process_dockerfile('P', 'r', 'Dockerfile'), [response(body=b"FROM alpine\n")])
+        self.assertNotIn('If-None-Match', requests[0].headers)
+
+
+class RetryDelayTest(unittest.TestCase):
+    def setUp(self):
+        self.delay = ds.AsyncBitbucketDockerScanner._retry_delay
+
+    def test_backoff(self):
+        self.assertEqual([self.delay(response(500), n) for n in (1, 2, 3)], [0.0, 0.6, 1.2])
+        self.assertEqual(self.delay(response(500), 20), ds._BACKOFF_MAX)
+
+    def test_retry_after_seconds(self):
+        self.assertEqual(self.delay(response(429, headers={'Retry-After': '7'}), 1), 7.0)
+        # Only honoured for statuses that define it
+        self.assertEqual(self.delay(response(500, headers={'Retry-After': '7'}), 1), 0.0)
+
+    def test_retry_after_date(self):
+        retry_at = datetime.now(timezone.utc) + timedelta(seconds=30)
+        headers = {'Retry-After': email.utils.format_datetime(retry_at, usegmt=True)}
+        self.assertAlmostEqual(self.delay(response(503, headers=headers), 1), 30, delta=2)
+
+
+if __name__ == '__main__':
+    unittest.main()